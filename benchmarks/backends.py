@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# checks the cache backends do what the caches rely on: values expire after their ttl, purge() sweeps them,
+# and the Redis client speaks RESP, authenticates and selects its database again after losing its
+# connection.  File and SQLite run in a temporary directory; Redis only when given a server to use, whose
+# keys under the "feedfuser-check:" prefix are overwritten.  Exits with status 1 when a check fails.
+#
+#     python benchmarks/backends.py [redis://[:password@]localhost:6379[/db]]
+
+import os, sys, io, socket, tempfile, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import backends
+
+TTL = 0.3
+failures = []
+
+
+def check(name, ok):
+    print("%-4s %s" % ("ok" if ok else "FAIL", name))
+    if not ok:
+        failures.append(name)
+
+
+def raises(exc_type, fn, *args):
+    try:
+        fn(*args)
+    except exc_type:
+        return True
+    return False
+
+
+def check_resp():
+    check("encode_command", backends.encode_command(["SET", "k", b"\x00v\r\n"])
+          == b"*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$4\r\n\x00v\r\n\r\n")
+    replies = [(b"+OK\r\n", b"OK"), (b":42\r\n", 42), (b"$5\r\na\r\nbc\r\n", b"a\r\nbc"), (b"$0\r\n\r\n", b""),
+               (b"$-1\r\n", None), (b"*-1\r\n", None), (b"*2\r\n$1\r\na\r\n:1\r\n", [b"a", 1])]
+    for data, expected in replies:
+        check("read_reply %r" % data, backends.read_reply(io.BytesIO(data)) == expected)
+    check("read_reply error reply", raises(backends.BackendError, backends.read_reply, io.BytesIO(b"-ERR no\r\n")))
+    for data in (b"", b"+OK", b"$5\r\nab"):
+        check("read_reply truncated %r" % data, raises(ConnectionError, backends.read_reply, io.BytesIO(data)))
+
+
+def check_ttl(name, backend):
+    backend.set("check/kept", b"kept")
+    backend.set("check/expiring", b"expiring", ttl=TTL)
+    check("%s get" % name, backend.get("check/kept") == b"kept" and backend.get("check/expiring") == b"expiring")
+    time.sleep(TTL + 0.2)
+    check("%s expired after ttl" % name, backend.get("check/expiring") is None)
+    check("%s kept without ttl" % name, backend.get("check/kept") == b"kept")
+    backend.delete("check/kept")
+    check("%s delete" % name, backend.get("check/kept") is None)
+
+
+def check_purge(name, backend, stored):
+    backend.set("check/purged", b"purged", ttl=TTL)
+    backend.set("check/kept", b"kept")
+    time.sleep(TTL + 0.2)
+    backend.purge()
+    check("%s purge drops expired values only" % name, stored() == 1 and backend.get("check/kept") == b"kept")
+
+
+def check_local():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_backend = backends.backend_from_url("file://" + os.path.join(tmp_dir, "files"))
+        check_ttl("file", file_backend)
+        check_purge("file", file_backend, lambda: sum(len(names) for path, dirs, names in os.walk(file_backend.path)))
+        sqlite_backend = backends.backend_from_url("sqlite://" + os.path.join(tmp_dir, "cache.db"))
+        check_ttl("sqlite", sqlite_backend)
+        check_purge("sqlite", sqlite_backend, lambda: sqlite_backend.execute("SELECT COUNT(*) FROM cache")[0])
+        check("sqlite url without a path", raises(ValueError, backends.backend_from_url, "sqlite://"))
+
+
+def check_redis(url):
+    backend = backends.backend_from_url(url)
+    backend.prefix = "feedfuser-check:"
+    check_ttl("redis", backend)
+    # the same key in another database must stay unset, so a reconnect that forgot SELECT would show
+    other = backends.RedisBackend(host=backend.host, port=backend.port, db=1 if backend.db == 0 else 0,
+                                  password=backend.password, prefix=backend.prefix)
+    other.delete("check/db")
+    backend.set("check/db", b"db")
+    check("redis SELECT", other.get("check/db") is None)
+    backend.local.connection[0].shutdown(socket.SHUT_RDWR)
+    check("redis lost connection raises", raises(OSError, backend.get, "check/db"))
+    check("redis reconnects to the same database", backend.get("check/db") == b"db")
+    backend.delete("check/db")
+    if backend.password:
+        wrong = backends.RedisBackend(host=backend.host, port=backend.port, password=backend.password + "x")
+        check("redis wrong password", raises(backends.BackendError, wrong.get, "check/db"))
+        check("redis wrong password again", raises(backends.BackendError, wrong.get, "check/db"))
+
+
+def main():
+    check_resp()
+    check_local()
+    if len(sys.argv) > 1:
+        check_redis(sys.argv[1])
+    else:
+        print("skip redis (no server given)")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# per-entry cost of turning a feed entry's dates into datetimes: dateutil on every date string (as
+# FeedEntry.create_from_parsed_entry used to do) against feedops.parse_entry_date; and the cost of
+# feedparser's own _parse_date on an RFC 822 date, trying every handler in turn against starting with
+# the one a source's date_hint remembers.
+#
+#     python benchmarks/dates.py [entries]
+
+import os, sys, time, timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dateutil import parser
+from lib import feedops, feedparser
+
+
+def make_feed(count):
+    items = []
+    for i in range(count):
+        stamp = time.gmtime(1500000000 - i * 3600)
+        items.append('<item><title>item %d</title><guid>guid-%d</guid><pubDate>%s</pubDate>'
+                     '<atom:updated xmlns:atom="http://www.w3.org/2005/Atom">%s</atom:updated></item>'
+                     % (i, i, time.strftime("%a, %d %b %Y %H:%M:%S GMT", stamp),
+                        time.strftime("%Y-%m-%dT%H:%M:%SZ", stamp)))
+    return '<rss version="2.0"><channel><title>bench</title><link>http://example.com/</link>%s</channel></rss>' \
+        % "".join(items)
+
+
+def dateutil_dates(entries):
+    for entry in entries:
+        parser.parse(entry.get("published"))
+        parser.parse(entry.get("updated"))
+
+
+def feedops_dates(entries):
+    for entry in entries:
+        feedops.parse_entry_date(entry.get("published"), entry.get("published_parsed"))
+        feedops.parse_entry_date(entry.get("updated"), entry.get("updated_parsed"))
+
+
+def feedparser_dates(entries, hint):
+    for entry in entries:
+        feedparser._date_cache.clear()
+        feedparser._parse_date(entry.get("published"), hint)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    entries = feedparser.parse(make_feed(count)).entries
+    hint = {}
+    for name, func in [("dateutil", dateutil_dates), ("parse_entry_date", feedops_dates),
+                       ("_parse_date", lambda entries: feedparser_dates(entries, None)),
+                       ("_parse_date, hint", lambda entries: feedparser_dates(entries, hint))]:
+        seconds = min(timeit.repeat(lambda: func(entries), number=1, repeat=5))
+        print("%-18s %8.2f us per entry" % (name, seconds / count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
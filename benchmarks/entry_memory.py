@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# bytes of memory held per parsed entry, as a FeedEntry and as FeedEntry used to hold it: a plain object
+# with an instance __dict__, un-interned strings and feedparser's enclosure dicts.
+#
+#     python benchmarks/entry_memory.py [entries]
+
+import os, sys, time, gc, tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import feedops, feedparser
+
+AUTHORS = ["Mark Liberman", "Victor Mair", "Geoffrey K. Pullum", "Barbara Partee", "Bill Poser"]
+
+
+def make_feed(count):
+    items = []
+    for i in range(count):
+        stamp = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(1500000000 - i * 3600))
+        items.append('<item><title>item %d</title><link>http://example.com/%d</link><guid>guid-%d</guid>'
+                     '<author>%s</author><pubDate>%s</pubDate><description>&lt;p&gt;summary %d&lt;/p&gt;</description>'
+                     '<enclosure url="http://example.com/%d.mp3" length="%d" type="audio/mpeg"/></item>'
+                     % (i, i, i, AUTHORS[i % len(AUTHORS)], stamp, i, i, 1000 + i))
+    return '<rss version="2.0"><channel><title>bench</title><link>http://example.com/</link>%s</channel></rss>' \
+        % "".join(items)
+
+
+class DictFeedEntry(object):
+    pass
+
+
+def build_dict_entry(entry):
+    item = DictFeedEntry()
+    item.guid = entry.get("id")
+    item.title = entry.get("title")
+    item.author = entry.get("author")
+    item.link = entry.get("link")
+    item.pub_date = feedops.parse_entry_date(entry.get("published"), entry.get("published_parsed"))
+    item.update_date = item.pub_date
+    item.summary_type = entry.summary_detail.type
+    item.summary = entry.get("summary")
+    item.content_type = None
+    item.content = None
+    item.enclosures = entry.get("enclosures")
+    return item
+
+
+def retained(build, document):
+    # memory still held by the built entries once everything else from the parse has been let go
+    gc.collect()
+    feedparser._date_cache.clear()
+    tracemalloc.start()
+    parsed_entries = feedparser.parse(document).entries
+    entries = [build(entry) for entry in parsed_entries]
+    del parsed_entries
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / len(entries)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    document = make_feed(count)
+    for name, build in [("__dict__, feedparser dicts", build_dict_entry),
+                        ("FeedEntry", feedops.FeedEntry.create_from_parsed_entry)]:
+        print("%-26s %8.0f bytes per entry" % (name, retained(build, document)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# wall time of refreshing a fused feed with many sources on one host, through FusedFeed.fetch (the shared
+# thread pool) and FusedFeed.fetch_async (from an asyncio event loop), against a local server that answers
+# each request after a fixed delay, as a remote server would after a round trip.  Both share the same
+# keep-alive connections, at most FEEDFUSER_MAX_PER_HOST at a time, so runs after the first don't pay for
+# connecting again.
+#
+#     python benchmarks/fetch.py [sources] [delay_ms]
+
+import os, sys, time, asyncio, threading, http.server
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import feedops
+
+
+def make_feed(name, count=20):
+    items = "".join('<item><title>%s item %d</title><guid>%s-%d</guid>'
+                    '<pubDate>Mon, 01 Jan 2018 %02d:00:00 GMT</pubDate></item>' % (name, i, name, i, i)
+                    for i in range(count))
+    return ('<rss version="2.0"><channel><title>%s</title><link>http://example.com/</link>%s</channel></rss>'
+            % (name, items)).encode('utf-8')
+
+
+class FeedHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.05
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = make_feed(self.path)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    FeedHandler.delay = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = "http://127.0.0.1:%d" % server.server_address[1]
+    for name, fetch in [("fetch", lambda feed: feed.fetch()),
+                        ("fetch_async", lambda feed: asyncio.run(feed.fetch_async()))]:
+        for run in ("cold", "warm"):
+            # a new feed each time, so that nothing but the connections is reused
+            feed = feedops.FusedFeed(name="bench", sources=[feedops.SourceFeed(uri="%s/feed/%s/%d" % (base, run, i))
+                                                            for i in range(count)])
+            start = time.perf_counter()
+            refreshed = fetch(feed)
+            seconds = time.perf_counter() - start
+            print("%-12s %s %8.1f ms  %d/%d sources, %d entries"
+                  % (name, run, seconds * 1000, len(refreshed), count, len(feed.entries)))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
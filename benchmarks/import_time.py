@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# how long a fresh worker takes to import the app and answer /, each run in a new interpreter as Passenger
+# would spawn one, and whether any of the modules that are meant to load on first use got imported anyway.
+# Exits with status 1 when the median goes over the budget, which depends on the machine: measure once,
+# then give it some headroom.
+#
+#     python benchmarks/import_time.py budget_ms [runs]
+
+import os, sys, json, subprocess, statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# imported where they are used, never at start-up
+LAZY_MODULES = ["lib.feedparser", "requests", "parsel", "lxml", "feedgen", "dateutil", "asyncio"]
+
+WORKER = """
+import sys, time, json
+start = time.perf_counter()
+import feedfuser
+imported = time.perf_counter()
+feedfuser.app.test_client().get("/")
+answered = time.perf_counter()
+print(json.dumps({"import": imported - start, "answer": answered - imported,
+                  "loaded": [name for name in %r if name in sys.modules]}))
+""" % LAZY_MODULES
+
+
+def run_worker():
+    output = subprocess.check_output([sys.executable, "-c", WORKER], cwd=ROOT)
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit("usage: %s budget_ms [runs]" % sys.argv[0])
+    budget = float(sys.argv[1])
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    results = [run_worker() for i in range(runs)]
+    import_ms = statistics.median(result["import"] for result in results) * 1000
+    answer_ms = statistics.median(result["answer"] for result in results) * 1000
+    loaded = sorted(set(name for result in results for name in result["loaded"]))
+    print("import feedfuser %8.1f ms" % import_ms)
+    print("first GET /      %8.1f ms" % answer_ms)
+    print("budget           %8.1f ms" % budget)
+    if loaded:
+        print("loaded at start-up: %s" % ", ".join(loaded))
+    if import_ms + answer_ms > budget or loaded:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,34 @@
 #!/usr/bin/env python3
 
-from flask import Flask, request, abort
-import os, os.path
+from flask import Flask, request, abort, make_response
+import os, os.path, datetime
 from werkzeug.utils import secure_filename
-from lib import feedops
-from feedgen.feed import FeedGenerator
+from lib import feedops, cache, scheduler, specs, backends
 
 app = Flask(__name__, static_folder="public")
 APP_ROOT = os.path.dirname(os.path.abspath(__file__))   # refers to application_top
 APP_STATIC = os.path.join(APP_ROOT, 'public')
 APP_CONFIG = os.path.join(APP_ROOT, 'config')
 APP_CONFIG_FEEDS = os.path.join(APP_ROOT, 'config', 'feeds')
+# shared by all worker processes: a directory, "sqlite:///path/to/cache.db" or "redis://host:port/db"
+APP_CACHE = os.environ.get("FEEDFUSER_CACHE") or os.path.join(APP_ROOT, 'cache')
+
+try:
+    cache_backend = backends.backend_from_url(APP_CACHE)
+except OSError as exc:
+    # like any other cache failure, this only costs us the cache: each worker keeps its own in memory
+    print(('%s could not be used as the cache, caching in memory only: %s' % (APP_CACHE, exc)))
+    cache_backend = None
+# a feed whose sources are past their refresh interval is still served at once while they are refreshed in the
+# background; only after this many seconds do requests wait for the refresh
+FEED_MAX_STALE = int(os.environ.get("FEEDFUSER_MAX_STALE", 3600))
+# a stored source copy has to outlive the oldest we would serve
+source_store = cache.ValidatorStore(cache_backend, max_age=max(7*24*3600, 2*FEED_MAX_STALE)) if cache_backend else None
+feedops.entry_cache = cache.EntryCache(backend=cache_backend)
+
+feed_specs = specs.SpecRegistry(APP_CONFIG_FEEDS, store=source_store)
+refresher = scheduler.RefreshScheduler(feed_specs, max_stale=FEED_MAX_STALE, backend=cache_backend)
+output_cache = cache.OutputCache(backend=cache_backend)
 
 
 @app.route('/')
@@ -20,25 +38,53 @@ def hello_world():
 
 @app.route('/feeds/<feed_id>/rss')
 def get_rss_feed(feed_id):
-    feed_gen = make_feed(feed_id, request)
-    return feed_gen.rss_str(pretty=True)
+    return serve_feed(feed_id, "rss", request)
 
 @app.route('/feeds/<feed_id>')
 def get_atom_feed(feed_id):
-    feed_gen = make_feed(feed_id, request)
-    return feed_gen.atom_str(pretty=True)
+    return serve_feed(feed_id, "atom", request)
 
 
-def make_feed(feed_id, request):
+def get_fused_feed(feed_id):
     feed_id = secure_filename(feed_id)
-    feed_config_filepath = os.path.join(APP_CONFIG_FEEDS, feed_id+".json")
-    if not os.path.isfile(feed_config_filepath):
-        # print(feed_config_filepath)
-        abort(404)
-    feed = feedops.FusedFeed.load_from_spec_file(feed_config_filepath)
+    # served from memory; the scheduler keeps the sources fresh in the background
+    feed = refresher.get(feed_id)
     if not feed:
-        abort(400)
-    feed.fetch()
+        # no such spec, or one that could not be loaded
+        abort(400 if feed_id in feed_specs else 404)
+    return feed_id, feed
+
+
+def serve_feed(feed_id, feed_format, request):
+    feed_id, feed = get_fused_feed(feed_id)
+    # the query string changes nothing in the feed, and must not let clients make up cache entries
+    cache_key = (feed_id, feed_format, request.base_url)
+    fingerprint = feed.fingerprint
+    rendered = output_cache.get(cache_key, fingerprint)
+    if not rendered:
+        # the fused entries changed since this was last rendered (or it never was), so the feed is modified as of
+        # now.  The newest entry's date won't do: edited entries, older entries coming in and spec changes all
+        # change the feed without a newer date.  A cache hit keeps this time for as long as the fingerprint holds
+        last_modified = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        fg = make_feed(feed, request, last_modified)
+        body = fg.rss_str(pretty=True) if feed_format == "rss" else fg.atom_str(pretty=True)
+        rendered = cache.RenderedFeed(body, last_modified=last_modified)
+        output_cache.put(cache_key, fingerprint, rendered)
+    response = make_response(rendered.body)
+    response.set_etag(rendered.etag)
+    response.last_modified = rendered.last_modified
+    freshness = refresher.freshness(feed_id)
+    if freshness:
+        # lets clients and proxies do the same: reuse the feed for a refresh interval, then keep
+        # using it while they revalidate, for as long as we would serve it without waiting
+        age, lifetime = freshness
+        response.headers["Age"] = str(int(age))
+        response.headers["Cache-Control"] = "public, max-age=%d, stale-while-revalidate=%d" \
+            % (lifetime, max(FEED_MAX_STALE - lifetime, 0))
+    return response.make_conditional(request)
+
+
+def make_feed(feed, request, last_modified=None):
     feed_uri = request.url_root
     if len(feed.sources) == 1:
         # if there is only 1 source in a fusedfeed
@@ -46,15 +92,20 @@ def make_feed(feed_id, request):
         # TODO: instead, we should generate our own HTML representation
         feed_uri = feed.sources[0].html_uri
 
+    from feedgen.feed import FeedGenerator  # imported on the first render, to keep worker start-up fast
     fg = FeedGenerator()
     fg.load_extension('podcast')
-    fg.id(request.url)
+    fg.id(request.base_url)
     fg.title(feed.name)
     fg.author({"name":"FeedFuser"})
     fg.generator("FeedFuser")
     fg.link(href=feed_uri, rel='alternate', type="text/html")
-    fg.link(href=request.url, rel='self')
+    fg.link(href=request.base_url, rel='self')
     fg.description(feed.name)
+    if last_modified:
+        # so that re-rendering unchanged entries gives byte-identical output
+        fg.updated(last_modified)
+        fg.lastBuildDate(last_modified)
 
     for entry in feed.entries:
         title = entry.title
@@ -70,8 +121,8 @@ def make_feed(feed_id, request):
         feed_item.link(link={"href": entry.link, "rel": "alternate", "type": "text/html"})
         if entry.enclosures:
             for enclosure in entry.enclosures:
-                if enclosure.get("href"):
-                    feed_item.enclosure(url=enclosure.get("href"), length=enclosure.get("length", 0), type=enclosure.get("type", ""))
+                if enclosure.href:
+                    feed_item.enclosure(url=enclosure.href, length=enclosure.length or 0, type=enclosure.type or "")
         if entry.summary:
             feed_item.summary(entry.summary)
         if entry.content:
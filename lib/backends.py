@@ -0,0 +1,274 @@
+import os, os.path
+import socket, struct, tempfile, threading, time
+import urllib.parse
+
+
+class BackendError(IOError):
+    pass
+
+
+def write_atomic(path, data):
+    # write to a temp file in the same directory, then rename over the target so
+    # readers in other workers never see a half-written file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class CacheBackend(object):
+    # bytes by key, shared by every worker process pointed at the same place.  Keys look like relative paths
+    # ("sources/<sha1>.json"); ttl is in seconds, after which get() no longer returns the value.
+    # Failures raise IOError (BackendError or OSError), which the caches treat as a miss
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def purge(self):
+        # drop expired values, for backends that don't do it themselves.  This may read every value, so it is
+        # left to a background thread (see RefreshScheduler), never done while a request waits
+        pass
+
+    @staticmethod
+    def expiry(ttl):
+        return time.time() + ttl if ttl else 0
+
+
+class FileBackend(CacheBackend):
+    # one file per key under path; works across processes on one host, or any shared filesystem.
+    # Each file starts with a magic number and its expiry time
+
+    header = struct.Struct("!4sd")
+    magic = b"FFC1"
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def __repr__(self):
+        return '%s(path="%s")' % (self.__class__.__name__, self.path)
+
+    def _path(self, key):
+        return os.path.join(self.path, *key.split("/"))
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < self.header.size:
+            return None
+        magic, expires = self.header.unpack_from(data)
+        if magic != self.magic:
+            return None
+        if expires and expires < time.time():
+            self.delete(key)
+            return None
+        return data[self.header.size:]
+
+    def set(self, key, value, ttl=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, self.header.pack(self.magic, self.expiry(ttl)) + value)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def purge(self):
+        now = time.time()
+        for dir_path, dir_names, file_names in os.walk(self.path):
+            for name in file_names:
+                path = os.path.join(dir_path, name)
+                try:
+                    with open(path, "rb") as f:
+                        head = f.read(self.header.size)
+                    magic, expires = self.header.unpack(head)
+                    if magic != self.magic or (expires and expires < now):
+                        os.remove(path)
+                except (OSError, struct.error):
+                    pass
+
+
+class SQLiteBackend(CacheBackend):
+    # one table in an SQLite database file, which workers on the same host (or a shared filesystem
+    # with working locks) open together
+
+    def __init__(self, path, timeout=10):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def __repr__(self):
+        return '%s(path="%s")' % (self.__class__.__name__, self.path)
+
+    def connection(self):
+        import sqlite3
+        # a connection can't be shared between threads, nor survive a fork
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                               "expires REAL NOT NULL)")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def execute(self, sql, args=()):
+        import sqlite3
+        try:
+            return self.connection().execute(sql, args).fetchone()
+        except sqlite3.Error as exc:
+            raise BackendError("%s: %s" % (self.path, exc))
+
+    def get(self, key):
+        row = self.execute("SELECT value, expires FROM cache WHERE key = ?", (key,))
+        if row is None or (row[1] and row[1] < time.time()):
+            return None
+        return bytes(row[0])
+
+    def set(self, key, value, ttl=None):
+        self.execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                     (key, value, self.expiry(ttl)))
+
+    def delete(self, key):
+        self.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def purge(self):
+        self.execute("DELETE FROM cache WHERE expires > 0 AND expires < ?", (time.time(),))
+
+
+class RedisBackend(CacheBackend):
+    # a Redis server (or anything speaking its protocol), through a minimal client of our own: one connection
+    # per thread, GET/SET/DEL only.  Redis expires values itself.  Values are unpickled by EntryCache, so only
+    # point this at a server no one else can write to
+
+    def __init__(self, host="localhost", port=6379, db=0, password=None, prefix="feedfuser:", timeout=5):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def __repr__(self):
+        return '%s(host="%s", port=%d, db=%d)' % (self.__class__.__name__, self.host, self.port, self.db)
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            connection = (sock, sock.makefile("rb"))
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+            # a failed command drops the connection again (see command), so a bad password isn't remembered
+            if self.password:
+                self.command("AUTH", self.password)
+            if self.db:
+                self.command("SELECT", str(self.db))
+        return connection
+
+    def command(self, *args):
+        sock, reader = self.connection()
+        try:
+            sock.sendall(encode_command(args))
+            return read_reply(reader)
+        except OSError:
+            # including error replies (BackendError).  The connection may be halfway through a reply;
+            # start over with a new one next time
+            self.local.connection = None
+            sock.close()
+            raise
+
+    def get(self, key):
+        return self.command("GET", self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self.command("SET", self.prefix + key, value, "PX", str(int(ttl * 1000)))
+        else:
+            self.command("SET", self.prefix + key, value)
+
+    def delete(self, key):
+        self.command("DEL", self.prefix + key)
+
+
+def encode_command(args):
+    # a command as a RESP array of bulk strings
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode('utf-8')
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def read_reply(reader):
+    line = reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("connection closed by server")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest
+    if kind == b"-":
+        raise BackendError(rest.decode('utf-8', 'replace'))
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        if len(data) != length + 2:
+            raise ConnectionError("connection closed by server")
+        return data[:-2]
+    if kind == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [read_reply(reader) for i in range(length)]
+    raise BackendError("unexpected reply from server: %r" % line)
+
+
+def backend_from_url(url):
+    # "redis://[:password@]host[:port][/db]", "sqlite:///path/to/cache.db", "file:///path/to/dir" or just a path.
+    # With two slashes ("sqlite://cache.db") the path is relative
+    parts = urllib.parse.urlparse(url)
+    if parts.scheme == "redis":
+        db = parts.path.strip("/")
+        return RedisBackend(host=parts.hostname or "localhost", port=parts.port or 6379, db=int(db) if db else 0,
+                            password=urllib.parse.unquote(parts.password) if parts.password else None)
+    if parts.scheme == "sqlite":
+        return SQLiteBackend(url_path(url, parts))
+    if parts.scheme == "file":
+        return FileBackend(url_path(url, parts))
+    if parts.scheme:
+        raise ValueError('unknown cache backend "%s"' % url)
+    return FileBackend(url)
+
+
+def url_path(url, parts):
+    # an empty path would have sqlite3 open a private temporary database, and FileBackend fail on makedirs
+    path = parts.netloc + parts.path
+    if not path:
+        raise ValueError('no path in cache backend "%s"' % url)
+    return path
@@ -0,0 +1,209 @@
+import json, hashlib, threading, pickle, zlib, time
+import collections
+
+# everything that can't be read back from the shared cache backend (lib/backends.py) is treated as a miss
+UNPICKLE_ERRORS = (IOError, OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError)
+
+
+def cache_key(uri):
+    return hashlib.sha1(uri.encode('utf-8')).hexdigest()
+
+
+class SourceRecord(object):
+
+    def __init__(self, uri, etag=None, last_modified=None, digest=None, headers=None, checked=None, stored=None):
+        self.uri = uri
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digest = digest
+        self.headers = headers or {}  # the response headers needed to parse the body again
+        self.checked = checked  # when upstream last sent this body or confirmed it with a 304
+        self.stored = stored  # when the body was last written to the backend
+
+    def __repr__(self):
+        return '%s(uri="%s")' % (self.__class__.__name__, self.uri.encode('utf-8'))
+
+
+class ValidatorStore(object):
+    # keeps the HTTP validators (ETag / Last-Modified) and the last good body for each source uri in the cache
+    # backend, so that conditional GETs keep working across requests, worker processes and restarts, and a
+    # worker can use a body another one has just fetched.  Bodies are stored zlib-compressed and only read
+    # back when there is nothing else to rebuild entries from.  Sources nobody fetches anymore (removed from their
+    # specs) expire after max_age, which must be longer than the oldest copy the app serves
+
+    def __init__(self, backend, max_age=7*24*3600):
+        self.backend = backend
+        self.max_age = max_age
+
+    def __repr__(self):
+        return '%s(backend=%r)' % (self.__class__.__name__, self.backend)
+
+    def _keys(self, uri):
+        key = cache_key(uri)
+        return "sources/%s.json" % key, "sources/%s.body.z" % key
+
+    def get(self, uri):
+        meta_key, body_key = self._keys(uri)
+        try:
+            data = self.backend.get(meta_key)
+            meta = json.loads(data.decode('utf-8')) if data else None
+        except (IOError, ValueError):
+            return None
+        if not meta:
+            return None
+        return SourceRecord(uri=uri, etag=meta.get("etag"), last_modified=meta.get("last_modified"),
+                            digest=meta.get("digest"), headers=meta.get("headers"), checked=meta.get("checked"),
+                            stored=meta.get("stored"))
+
+    def get_body(self, uri):
+        meta_key, body_key = self._keys(uri)
+        try:
+            data = self.backend.get(body_key)
+            return zlib.decompress(data) if data else None
+        except (IOError, zlib.error):
+            return None
+
+    def put(self, record, body=None):
+        # without a body, only the metadata is updated (after a 304).  The body then is written again now and
+        # then, so that it doesn't expire before the metadata that refers to it
+        meta_key, body_key = self._keys(record.uri)
+        now = time.time()
+        if body is None and (not record.stored or record.stored < now - self.max_age / 2):
+            body = self.get_body(record.uri)
+        stored = now if body else record.stored
+        meta = {'uri': record.uri, 'etag': record.etag, 'last_modified': record.last_modified, 'digest': record.digest,
+                'headers': record.headers, 'checked': record.checked, 'stored': stored}
+        # body first: a metadata file without its body would make us send validators we can't honor on a 304
+        if body:
+            self.backend.set(body_key, zlib.compress(body), ttl=self.max_age)
+        self.backend.set(meta_key, json.dumps(meta).encode('utf-8'), ttl=self.max_age)
+
+    def delete(self, uri):
+        for key in self._keys(uri):
+            self.backend.delete(key)
+
+
+def body_digest(body):
+    return hashlib.sha1(body).hexdigest()
+
+
+class EntryCache(object):
+    # parsed entries by digest of the response body they came from, so a body we have seen before
+    # is never parsed again.  Kept in memory with LRU eviction and, if given a backend, there as well,
+    # for other workers and later restarts; entries not written again within max_age expire
+
+    def __init__(self, max_size=512, backend=None, max_age=7*24*3600):
+        self.max_size = max_size
+        self.backend = backend
+        self.max_age = max_age
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(max_size=%d, backend=%r)' % (self.__class__.__name__, self.max_size, self.backend)
+
+    def _key(self, digest):
+        return "entries/%s.pickle" % digest
+
+    def get(self, digest):
+        if not digest:
+            return None
+        with self.lock:
+            value = self.items.get(digest)
+            if value is not None:
+                self.items.move_to_end(digest)
+                return value
+        if not self.backend:
+            return None
+        try:
+            data = self.backend.get(self._key(digest))
+            value = pickle.loads(data) if data else None
+        except UNPICKLE_ERRORS:
+            return None
+        if value is None:
+            return None
+        self._remember(digest, value)
+        return value
+
+    def put(self, digest, value):
+        self._remember(digest, value)
+        if not self.backend:
+            return
+        try:
+            self.backend.set(self._key(digest), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ttl=self.max_age)
+        except (IOError, OSError, pickle.PicklingError) as exc:
+            print(("%s %s" % (digest, "could not save to entry cache: %s" % exc)))
+
+    def _remember(self, digest, value):
+        with self.lock:
+            self.items[digest] = value
+            self.items.move_to_end(digest)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+
+class RenderedFeed(object):
+
+    def __init__(self, body, last_modified, etag=None):
+        self.body = body
+        self.last_modified = last_modified  # when the rendered content last changed
+        self.etag = etag or hashlib.sha1(body).hexdigest()
+
+    def __repr__(self):
+        return '%s(etag="%s")' % (self.__class__.__name__, self.etag)
+
+
+class OutputCache(object):
+    # serialized feeds by (feed id, format, url without the query string), each tagged with the fingerprint of the fused entries
+    # it was rendered from; an entry is only returned while that fingerprint still matches.  Kept in memory and,
+    # if given a backend, there as well, so a feed one worker has rendered is served as is by the others
+
+    def __init__(self, max_size=256, backend=None, max_age=24*3600):
+        self.max_size = max_size
+        self.backend = backend
+        self.max_age = max_age
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(max_size=%d, backend=%r)' % (self.__class__.__name__, self.max_size, self.backend)
+
+    def _key(self, key):
+        return "output/%s.pickle" % cache_key(repr(key))
+
+    def get(self, key, fingerprint):
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and item[0] == fingerprint:
+                self.items.move_to_end(key)
+                return item[1]
+        if self.backend:
+            try:
+                data = self.backend.get(self._key(key))
+                item = pickle.loads(data) if data else None
+            except UNPICKLE_ERRORS:
+                item = None
+            if item is not None and item[0] == fingerprint:
+                self._remember(key, item)
+                return item[1]
+        with self.lock:
+            # the sources changed since this was rendered
+            self.items.pop(key, None)
+        return None
+
+    def put(self, key, fingerprint, rendered):
+        item = (fingerprint, rendered)
+        self._remember(key, item)
+        if not self.backend:
+            return
+        try:
+            self.backend.set(self._key(key), pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL), ttl=self.max_age)
+        except (IOError, OSError, pickle.PicklingError) as exc:
+            print(("%s %s" % (key, "could not save to output cache: %s" % exc)))
+
+    def _remember(self, key, item):
+        with self.lock:
+            self.items[key] = item
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
@@ -1,35 +1,178 @@
-import json, itertools, datetime
+import json, itertools, datetime, uuid, functools, time, calendar, re, threading, sys
+import heapq
 import collections, collections.abc
 import concurrent.futures
-import requests
-from lib import feedparser
+from lib import cache, fetcher, patterns
 import hashlib
-import parsel
-from dateutil import parser
+# feedparser, requests, parsel/lxml, dateutil and asyncio take most of the time it takes to start a worker and
+# many requests never need them (a feed served from memory, an entry cache hit), so they are imported where used
 
 
-def mp_fetch(source):
-    # wrapper: multiprocessing does not like classes and class methods. top-level only
-    return source.fetch()
+# parsed entries by response body digest, shared by every source in the process; see cache.EntryCache
+entry_cache = cache.EntryCache()
 
 
-def all_subclasses(cls):
-    return set(cls.__subclasses__()).union(
-        [s for c in cls.__subclasses__() for s in all_subclasses(c)])
+def entry_date(entry):
+    return entry.update_date
+
+
+def entry_timestamp(entry):
+    date = entry.update_date
+    if date.tzinfo is None:
+        # dateutil leaves dates without an offset naive; feeds mean UTC by those
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date.timestamp()
+
+
+def parsed_entry_timestamp(entry):
+    # the timestamp FeedEntry.create_from_parsed_entry would give this raw entry, taken from feedparser's own
+    # parse of the dates; None when that can't be known without building the entry
+    if entry.get("updated"):
+        date = entry.get("updated_parsed")
+    else:
+        date = entry.get("published_parsed") if entry.get("published") else None
+    if not date:
+        return None
+    return calendar.timegm(date)
+
+
+def parse_entry_date(date_string, date_parsed=None):
+    # feedparser has usually parsed the date already, into a UTC time tuple; dateutil only gets what it couldn't
+    if date_parsed:
+        return datetime.datetime(*date_parsed[:5], min(date_parsed[5], 59), tzinfo=datetime.timezone.utc)
+    return parse_date_string(date_string)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_date_string(date_string):
+    from dateutil import parser
+    date = parser.parse(date_string)
+    if date.tzinfo is None:
+        # feeds mean UTC by dates without an offset
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date
+
+
+def min_limit(*limits):
+    limits = [limit for limit in limits if limit]
+    return min(limits) if limits else None
+
+
+# the response headers feedparser picks a body's encoding and base uri from.  requests has already undone any
+# Content-Encoding, so passing that on would make feedparser try to decompress the body again
+PARSER_HEADERS = ("content-type", "content-location", "content-language")
+
+
+def parser_headers(headers):
+    return {name: headers[name] for name in PARSER_HEADERS if name in headers}
+
+
+def parse_failed(parsed_feed):
+    from lib import feedparser
+    # feedparser also flags feeds served with a non-XML media type or the wrong charset, but parses them all the same
+    exc = parsed_feed.get("bozo_exception")
+    return exc is not None and not isinstance(exc, feedparser.ThingsNobodyCaresAboutButMe)
+
+
+# the namespaces parsel makes available to XPath expressions
+XPATH_NAMESPACES = {"re": "http://exslt.org/regular-expressions", "set": "http://exslt.org/sets"}
+
+_parsed_fields = threading.local()
+
+
+def parsed_field(entry, field):
+    # the HTML in an entry's field, parsed at most once while filters look at that entry: every xpath rule,
+    # in every filter, shares it.  Only the last entry each thread looked at is kept
+    parsed = getattr(_parsed_fields, "parsed", None)
+    if parsed is None or parsed[0] is not entry:
+        parsed = (entry, {})
+        _parsed_fields.parsed = parsed
+    documents = parsed[1]
+    if field not in documents:
+        import parsel
+        text = getattr(entry, field, None)
+        documents[field] = parsel.Selector(text).root if text else None
+    return documents[field]
+
+
+# FeedEntry fields that are copied unchanged from the raw feedparser entry, so filters on them can run first
+RAW_ENTRY_FIELDS = frozenset(["title", "author", "link"])
+
+
+class RawEntryView(object):
+    # what filters see of a raw feedparser entry when they run before the FeedEntry is built
+    __slots__ = ("title", "author", "link")
+
+    def __init__(self, entry):
+        self.title = entry.get("title")
+        self.author = entry.get("author")
+        self.link = entry.get("link")
+
+
+class ClassRegistry(object):
+    # name -> class for the filter types and rule ops a spec can name.  Classes are added as they are defined;
+    # third-party ones are found through an entry point group the first time a name isn't known, e.g.
+    #     [options.entry_points]
+    #     feedfuser.rules =
+    #         fuzzy = feedfuser_fuzzy:FuzzyRule
+
+    def __init__(self, kind, entry_point_group):
+        self.kind = kind
+        self.entry_point_group = entry_point_group
+        self.classes = {}
+        self.plugins_loaded = False
+
+    def __repr__(self):
+        return '%s(kind="%s")' % (self.__class__.__name__, self.kind)
+
+    def register(self, name, cls):
+        self.classes[name] = cls
+
+    def lookup(self, name):
+        cls = self.classes.get(name)
+        if cls is None and not self.plugins_loaded:
+            self.load_plugins()
+            cls = self.classes.get(name)
+        if cls is None:
+            raise ValueError('unknown %s "%s" (known: %s)' % (self.kind, name, ", ".join(sorted(self.classes))))
+        return cls
+
+    def load_plugins(self):
+        import importlib.metadata
+        self.plugins_loaded = True
+        try:
+            entry_points = importlib.metadata.entry_points(group=self.entry_point_group)
+        except TypeError:
+            # before Python 3.10
+            entry_points = importlib.metadata.entry_points().get(self.entry_point_group, [])
+        for entry_point in entry_points:
+            try:
+                cls = entry_point.load()
+            except Exception as exc:
+                print(('%s plugin %s could not be loaded: %s' % (self.entry_point_group, entry_point.name, exc)))
+                continue
+            self.classes.setdefault(entry_point.name, cls)
 
 
 class FusedFeed(object):
 
-    def __init__(self, name, sources, filters=None):
+    def __init__(self, name, sources, filters=None, refresh_interval=None, max_entries=None, max_age=None):
         self.name = name
         self.sources = sources
         self.filters = filters
+        self.refresh_interval = refresh_interval
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.predicate = compile_filters(filters)
+        self.push_down_limits()
+        self._fingerprint = (None, None)
+        self._entries = (None, None)
 
     def __repr__(self):
         return '%s(name="%s")' % (self.__class__.__name__, self.name.encode('utf-8'))
 
     @classmethod
-    def load_from_spec_file(cls, spec_file_path):
+    def load_from_spec_file(cls, spec_file_path, store=None):
         filters = None
         data = json.load(open(spec_file_path, "r"))
         if not data:
@@ -37,37 +180,94 @@ class FusedFeed(object):
         name = data.get('name')
         sources = data.get('sources')
         if sources:
-            sources = SourceFeed.load_from_list(sources)
+            sources = SourceFeed.load_from_list(sources, store=store)
         if data.get('filters'):
             filters = FeedFilter.load_from_list(data.get("filters"))
-        return cls(name=name, sources=sources, filters=filters)
-
-    def fetch(self, max_workers=5):
-        feeds = []
-        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
-            future_feed = {executor.submit(mp_fetch, source): source for source in self.sources}
-            for future in concurrent.futures.as_completed(future_feed):
-                old_feed = future_feed[future]
-                try:
-                    new_feed = future.result(timeout=10)
-                except Exception as exc:
-                    print(('%r generated an exception: %s' % (old_feed.uri, exc)))
-                else:
-                    if new_feed:
-                        feeds.append(new_feed)
-            self.sources = feeds
-        return self
+        return cls(name=name, sources=sources, filters=filters, refresh_interval=data.get("refresh_interval"),
+                   max_entries=data.get("max_entries"), max_age=data.get("max_age"))
+
+    def push_down_limits(self):
+        # nothing older than max_age can make it into this feed, so sources can drop it as they parse.
+        # Sources may only stop at max_entries if no fused filter could throw away some of their newest entries
+        for source in self.sources or []:
+            source.max_age = min_limit(source.max_age, self.max_age)
+            if not self.filters:
+                source.max_entries = min_limit(source.max_entries, self.max_entries)
+
+    def fetch(self, timeout=10):
+        # sources are fetched in place on the process-wide fetch pool (see lib/fetcher.py).  A source that fails
+        # keeps its last good entries and stays in the feed; returns the sources that were refreshed
+        refreshed = []
+        future_feed = {fetcher.submit(source.fetch, timeout=timeout): source for source in self.sources or []}
+        for future in concurrent.futures.as_completed(future_feed):
+            source = future_feed[future]
+            try:
+                new_feed = future.result()
+            except Exception as exc:
+                print(('%r generated an exception: %s' % (source.uri, exc)))
+            else:
+                if new_feed:
+                    refreshed.append(new_feed)
+        return refreshed
+
+    async def fetch_async(self, timeout=10):
+        import asyncio
+        sources = self.sources or []
+        results = await asyncio.gather(*[source.fetch_async(timeout=timeout) for source in sources],
+                                       return_exceptions=True)
+        refreshed = []
+        for source, new_feed in zip(sources, results):
+            if isinstance(new_feed, Exception):
+                print(('%r generated an exception: %s' % (source.uri, new_feed)))
+            elif new_feed:
+                refreshed.append(new_feed)
+        return refreshed
+
+    def iter_entries(self):
+        # every source keeps its entries newest first, so the fused feed is a k-way merge of them
+        entries = heapq.merge(*[source.entries for source in self.sources or []], key=entry_date, reverse=True)
+        if self.max_age:
+            cutoff = time.time() - self.max_age
+            entries = itertools.takewhile(lambda entry: entry_timestamp(entry) >= cutoff, entries)
+        if self.predicate:
+            entries = filter(self.predicate, entries)
+        return entries
+
+    def merge_entries(self, limit=None):
+        return list(itertools.islice(self.iter_entries(), limit))
 
     @property
     def entries(self):
-        combined = [source.entries for source in self.sources]
-        entries = list(itertools.chain.from_iterable(combined))
-        if self.filters:
-            for fil in self.filters:
-                entries = fil.apply(entries)
-        entries.sort(key=lambda entry: entry.update_date, reverse=True)
+        # merged once per change of any source
+        revision, entries = self._entries
+        if revision == self.revision:
+            return entries
+        revision = self.revision
+        entries = self.merge_entries(self.max_entries)
+        self._entries = (revision, entries)
         return entries
 
+    @property
+    def revision(self):
+        return tuple(source.revision for source in self.sources or [])
+
+    @property
+    def fingerprint(self):
+        # a digest of everything that ends up in the rendered feed; only recomputed after a source has changed
+        revision, fingerprint = self._fingerprint
+        if revision == self.revision:
+            return fingerprint
+        revision = self.revision
+        digest = hashlib.sha1()
+        for text in itertools.chain([self.name], [source.html_uri for source in self.sources or []]):
+            digest.update(repr(text).encode('utf-8'))
+        for entry in self.entries:
+            digest.update(repr((entry.guid, entry.title, entry.author, entry.link, entry.pub_date, entry.update_date,
+                                entry.summary, entry.content, entry.content_type, entry.enclosures)).encode('utf-8'))
+        fingerprint = digest.hexdigest()
+        self._fingerprint = (revision, fingerprint)
+        return fingerprint
+
     @property
     def cache_info(self):
         return {feed.uri:{'etag':feed.etag, 'last-modified':feed.last_modified} for feed in self.sources}
@@ -82,96 +282,361 @@ class SourceFeed(object):
         self.password = kwargs.get("password")
         self.headers = kwargs.get("headers", {})
         self.filters = kwargs.get("filters", [])
+        # filters that only read raw entry fields run on the parsed feed, before any FeedEntry is built;
+        # the rest run on the built entries
+        self.pre_filters = [fil for fil in self.filters if fil.fields <= RAW_ENTRY_FIELDS]
+        self.post_filters = [fil for fil in self.filters if not fil.fields <= RAW_ENTRY_FIELDS]
+        self.pre_predicate = compile_filters(self.pre_filters)
+        self.predicate = compile_filters(self.post_filters)
         self.user_agent = kwargs.get("user_agent")
-        self.parsed = None
+        self.store = kwargs.get("store")
+        self.refresh_interval = kwargs.get("refresh_interval")
+        self.max_entries = kwargs.get("max_entries")
+        self.max_age = kwargs.get("max_age")
+        self.revision = None  # changes whenever self.entries is replaced
+        self.parsed = None  # (digest, html_uri, entries) of the last document, before this source's own filters
         self.entries = []
         self.etag = None
         self.last_modified = None
-        self.raw = None
+        self.digest = None
+        self.checked = None  # when upstream last sent or confirmed the document self.entries came from
+        self.known_entries = {}
+        self.verdicts = {}
+        self.date_hint = {}  # lets feedparser try the date format this source used last time first
+        self.lock = threading.Lock()
 
     def __repr__(self):
         return '%s(uri="%s")' % (self.__class__.__name__, self.uri.encode('utf-8'))
 
     @classmethod
-    def load_from_list(cls, lst):
-        feeds = list(map(SourceFeed.load_from_definition, lst))
+    def load_from_list(cls, lst, store=None):
+        feeds = [SourceFeed.load_from_definition(item, store=store) for item in lst]
         return feeds
 
     @classmethod
-    def load_from_definition(cls, item):
+    def load_from_definition(cls, item, store=None):
         if isinstance(item, collections.abc.Mapping):
             uri = item.get("uri")
             filters = []
             if item.get("filters"):
                 filters = FeedFilter.load_from_list(item.get("filters"))
-            return SourceFeed(uri=uri, filters=filters)
+            return SourceFeed(uri=uri, filters=filters, store=store, refresh_interval=item.get("refresh_interval"),
+                              max_entries=item.get("max_entries"), max_age=item.get("max_age"))
         else:
-            return SourceFeed(uri=item)
+            return SourceFeed(uri=item, store=store)
+
+    def load_cached(self):
+        # pick up validators from an earlier fetch, possibly made by another process
+        if not self.store or self.parsed:
+            return
+        record = self.store.get(self.uri)
+        if record:
+            self.etag = record.etag
+            self.last_modified = record.last_modified
+            self.digest = record.digest
+
+    def save_cached(self, document, body=None, headers=None):
+        # without a body (after a 304), the body already stored and its headers are kept
+        if not self.store:
+            return
+        try:
+            stored = None
+            if body is None:
+                record = self.store.get(self.uri)
+                if not record or record.digest != document.digest:
+                    return
+                headers = record.headers
+                stored = record.stored
+            self.store.put(cache.SourceRecord(uri=self.uri, etag=document.etag, last_modified=document.last_modified,
+                                              digest=document.digest, headers=headers, checked=document.checked,
+                                              stored=stored), body)
+        except (IOError, OSError) as exc:
+            print(("%s %s" % (self.uri, "could not save to validator store: %s" % exc)))
 
-    def fetch(self, timeout=10):
-        self.parsed = None
-        self.entries = []
+    @property
+    def flight_key(self):
+        # sources that would send the same request can share one response, whatever each then keeps of it
+        return (self.uri, self.username, self.password, self.user_agent, tuple(sorted(self.headers.items())))
+
+    @property
+    def parse_window(self):
+        # what build_entries may leave out, before any entry is built.  The count limit only applies
+        # there when no filters left for later could remove some of the newest entries
+        return (None if self.post_filters else self.max_entries, self.max_age,
+                tuple(fil.definition for fil in self.pre_filters))
+
+    def entry_cache_key(self, digest):
+        # the body is the same for every source of a uri, the entries built from it depend on the window
+        if not digest or self.parse_window == (None, None, ()):
+            return digest
+        return "%s-%s" % (digest, cache.body_digest(repr(self.parse_window).encode('utf-8')))
+
+    def fetch(self, timeout=10, fresh_for=None):
+        # concurrent fetches of the same uri, by this or any other SourceFeed, share one download and parse;
+        # each source then builds its own entries from it, within its own window.
+        # self.entries is only replaced once the new entries are complete, so a source can be
+        # refreshed in the background while its current entries are still being served.
+        # With fresh_for, a copy in the store that was fetched less than fresh_for seconds ago is used as is
+        document = fetcher.single_flight.do(self.flight_key, self.fetch_document, timeout=timeout, fresh_for=fresh_for)
+        parsed = self.document_entries(document) if document else None
+        if document and parsed is None and document.body is None:
+            # the body is the one we had, but this source has no entries for it: it joined the conditional
+            # request of another source, or the copy in the store is gone.  Ask for the whole feed
+            document = fetcher.single_flight.do(self.flight_key + ("unconditional",), self.fetch_document,
+                                                timeout=timeout, conditional=False)
+            parsed = self.document_entries(document) if document else None
+        if parsed is None:
+            return None
+        with self.lock:
+            return self.use_document(document, parsed)
+
+    def load_stored(self, fresh_for):
+        # entries from the copy in the store, without asking upstream, if upstream sent or confirmed it less than
+        # fresh_for seconds ago.  Only for a source that has no entries yet: a fetch that finished meanwhile
+        # has newer ones
+        if not self.store or self.revision:
+            return None
+        document = self.shared_document(fresh_for)
+        parsed = self.document_entries(document) if document else None
+        if parsed is None:
+            return None
+        with self.lock:
+            if self.revision:
+                return self
+            return self.use_document(document, parsed)
+
+    def use_document(self, document, parsed):
+        html_uri, entries = parsed
+        self.etag = document.etag
+        self.last_modified = document.last_modified
+        self.digest = document.digest
+        self.checked = document.checked
+        changed = self.revision is None or self.html_uri != html_uri
+        self.html_uri = html_uri
+        self.parsed = (document.digest, html_uri, entries)
+        if self.predicate:
+            entries = self.apply_filters(entries)
+        # newest first, as FusedFeed.iter_entries expects.  Feeds are usually in that order already,
+        # which makes this sort close to a single pass
+        entries = sorted(entries, key=entry_date, reverse=True)
+        if self.max_age:
+            # build_entries already left out what was too old then; entries keep ageing between parses
+            cutoff = time.time() - self.max_age
+            entries = list(itertools.takewhile(lambda entry: entry_timestamp(entry) >= cutoff, entries))
+        if self.max_entries:
+            entries = entries[:self.max_entries]
+        # unchanged entries are the same objects as before (see build_entries), so after a 304 or a body we had
+        # parsed already this is usually the same list, and what FusedFeed memoizes by revision stays valid
+        if changed or len(entries) != len(self.entries) or any(a is not b for a, b in zip(entries, self.entries)):
+            self.entries = entries
+            self.revision = uuid.uuid4().hex
+        return self
+
+    def apply_filters(self, entries):
+        # an entry object we have already filtered gets the same verdict again, so only entries that are
+        # new or changed since the last fetch go through the filters
+        verdicts = {}
+        predicate = self.predicate
+        for entry in entries:
+            verdict = self.verdicts.get(id(entry))
+            if not verdict:
+                # the entry itself is kept in the verdict so its id can't be reused while the verdict is around
+                verdict = (entry, predicate(entry))
+            verdicts[id(entry)] = verdict
+        self.verdicts = verdicts
+        return [entry for entry in entries if verdicts[id(entry)][1]]
+
+    def fetch_document(self, timeout=10, fresh_for=None, conditional=True):
+        import requests
+        if conditional and fresh_for and self.store:
+            document = self.shared_document(fresh_for)
+            if document:
+                return document
         args = {'timeout': timeout}
         if self.username and self.password:
             args['auth'] = (self.username, self.password)
         if self.user_agent:
             args['User-Agent'] = self.user_agent
-        args['headers'] = self.headers
-        if self.etag:
-            args['headers']['If-None-Match'] = self.etag
-        if self.last_modified:
-            args['headers']['If-Modified-Since'] = self.last_modified
+        args['headers'] = dict(self.headers)
+        if conditional:
+            self.load_cached()
+            if self.etag:
+                args['headers']['If-None-Match'] = self.etag
+            if self.last_modified:
+                args['headers']['If-Modified-Since'] = self.last_modified
         try:
-            r = requests.get(self.uri, **args)
+            r = fetcher.get_session().get(self.uri, **args)
         except requests.exceptions.Timeout:
             return None
         if 300 > r.status_code >= 200:
             #print(("%s" % (r.headers.get("etag"))))
-            parsed_feed = None
-            if r.text:
-                parsed_feed = feedparser.parse(r.text)
-                self.raw = r.text
-            if not parsed_feed or parsed_feed.get("bozo_exception"):
-                # can't parse whatever text is available, return nothing.
-                print(("%s %s" % (self.uri, " failed to parse feed.  Returning nothing")))
-                return None
+            # the body goes to feedparser as bytes, which works out its encoding from the headers and the
+            # document itself, as RFC 3023 asks; r.text would have requests guess one and decode the whole body first
+            body = r.content
+            headers = parser_headers(r.headers)
+            # a full response replaces the old validators, including ones the server stopped sending
+            document = SourceDocument(uri=self.uri, etag=r.headers.get('etag'),
+                                      last_modified=r.headers.get("last-modified"),
+                                      digest=cache.body_digest(body) if body else None, body=body, headers=headers)
+            if not self.cached_entries(document.digest):
+                # a body we haven't seen before (plenty of servers resend unchanged feeds with a 200).  Parse it
+                # now, so one that doesn't parse is neither stored nor handed to the other sources
+                parsed_feed = document.parse(self.date_hint)
+                if not parsed_feed or parse_failed(parsed_feed):
+                    # can't parse whatever text is available, return nothing.
+                    print(("%s %s" % (self.uri, " failed to parse feed.  Returning nothing")))
+                    return None
+            self.save_cached(document, body, headers)
         elif r.status_code == 304:
-            if self.raw:
-                # assume that if we already have text that this is reusing a cached object; just reparse the old text
-                parsed_feed = feedparser.parse(self.raw)
-            else:
-                # we don't have cached text and the server 304s.  We shouldn't have used the ETag/Last-Modified; return with nothing
-                print(("%s %s" % (self.uri, "returning fail")))
-                return None
+            # overwrite the old cache data with the new ones.  The entries of the body we had are found
+            # by document_entries, for each source sharing this
+            document = SourceDocument(uri=self.uri, etag=r.headers.get('etag') or self.etag,
+                                      last_modified=r.headers.get("last-modified") or self.last_modified,
+                                      digest=self.digest)
+            self.save_cached(document)
         else:
             print(("%s %s" % (self.uri, "utter fail")))
             # a 400+ code (or a 30x redirect, which shouldn't happen)
             return None
-        if r.headers.get('etag'):
-            self.etag = r.headers.get('etag') # overwrite the old cache data with the new ones
-        if r.headers.get("last-modified"):
-            self.last_modified = r.headers.get("last-modified")
+        return document
+
+    def shared_document(self, fresh_for):
+        # what any worker using the same store got from upstream less than fresh_for seconds ago, so that
+        # workers don't each ask upstream for the same feed
+        record = self.store.get(self.uri)
+        if not record or not record.checked or record.checked < time.time() - fresh_for:
+            return None
+        return SourceDocument(uri=self.uri, etag=record.etag, last_modified=record.last_modified,
+                              digest=record.digest, checked=record.checked)
+
+    def document_entries(self, document):
+        # this source's (html_uri, entries) from a shared document: kept from the last fetch, from the entry
+        # cache, or built from the body, which is parsed once for every source sharing it.  Without a body
+        # (after a 304) it is parsed again from the copy in the validator store
+        parsed = self.cached_entries(document.digest)
+        if parsed:
+            return parsed
+        if document.body is not None:
+            parsed_feed = document.parse(self.date_hint)
+        else:
+            parsed_feed = self.stored_feed(document.digest)
+        if not parsed_feed or parse_failed(parsed_feed):
+            return None
+        parsed = self.build_entries(parsed_feed)
+        if document.digest:
+            entry_cache.put(self.entry_cache_key(document.digest), parsed)
+        return parsed
+
+    def cached_entries(self, digest):
+        # the entries of a body we already built them for, without parsing it again
+        if not digest:
+            return None
+        if self.parsed and self.parsed[0] == digest:
+            return self.parsed[1:]
+        return entry_cache.get(self.entry_cache_key(digest))
+
+    def stored_feed(self, digest):
+        record = self.store.get(self.uri) if self.store and digest else None
+        body = self.store.get_body(self.uri) if record else None
+        if not body or cache.body_digest(body) != digest:
+            return None
+        from lib import feedparser
+        return feedparser.parse(body, response_headers=record.headers, date_hint=self.date_hint)
+
+    def build_entries(self, parsed_feed):
         #self.parsed = parsed_feed
-        self.html_uri = parsed_feed.feed.link
-        for entry in parsed_feed.entries:
-            feed_item = FeedEntry.create_from_parsed_entry(entry)
+        # entries whose guid and fingerprint match the last parse are reused as they are,
+        # so only new or changed entries are built and date-parsed
+        known_entries = {}
+        entries = []
+        for entry in self.window_parsed_entries(parsed_feed.entries):
+            guid = entry.get("id")
+            fingerprint = FeedEntry.parsed_entry_fingerprint(entry)
+            feed_item = None
+            if guid:
+                known = self.known_entries.get(guid)
+                if known and known[0] == fingerprint:
+                    feed_item = known[1]
+            if not feed_item:
+                feed_item = FeedEntry.create_from_parsed_entry(entry)
             if feed_item:
-                self.entries.append(feed_item)
-        if self.filters:
-            for fil in self.filters:
-                self.entries = fil.apply(self.entries)
-        return self
+                entries.append(feed_item)
+                if guid:
+                    known_entries[guid] = (fingerprint, feed_item)
+        self.known_entries = known_entries
+        return parsed_feed.feed.get("link"), entries
+
+    def window_parsed_entries(self, parsed_entries):
+        max_entries, max_age, pre_filters = self.parse_window
+        if max_age:
+            cutoff = time.time() - max_age
+            parsed_entries = [entry for entry in parsed_entries
+                              if (parsed_entry_timestamp(entry) or cutoff) >= cutoff]
+        if self.pre_predicate:
+            # blocked entries are never built, so never pay for date parsing and copying content
+            pre_predicate = self.pre_predicate
+            parsed_entries = [entry for entry in parsed_entries if pre_predicate(RawEntryView(entry))]
+        if max_entries and len(parsed_entries) > max_entries:
+            # entries without a date get the current time when they are built, so they count as newest
+            parsed_entries = heapq.nlargest(max_entries, parsed_entries,
+                                            key=lambda entry: parsed_entry_timestamp(entry) or float("inf"))
+        return parsed_entries
+
+    async def fetch_async(self, timeout=10):
+        # the pooled keep-alive client is blocking, so it runs on the shared fetch pool
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(fetcher.get_pool(), functools.partial(self.fetch, timeout=timeout))
+
+
+class SourceDocument(object):
+    # one fetched upstream document, shared by every SourceFeed that asked for it at the same time.  body is
+    # None when upstream answered 304, or another worker fetched it moments ago
+
+    def __init__(self, uri, etag=None, last_modified=None, digest=None, body=None, headers=None, checked=None):
+        self.uri = uri
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digest = digest
+        self.checked = checked or time.time()  # when upstream sent or confirmed it
+        self.body = body
+        self.headers = headers
+        self.parsed_feed = None
+        self.lock = threading.Lock()
+
+    def parse(self, date_hint=None):
+        # parsed on first use, once for all the sources sharing the document
+        with self.lock:
+            if self.parsed_feed is None and self.body:
+                from lib import feedparser
+                self.parsed_feed = feedparser.parse(self.body, response_headers=self.headers, date_hint=date_hint)
+            return self.parsed_feed
+
+    def __repr__(self):
+        return '%s(uri="%s")' % (self.__class__.__name__, self.uri.encode('utf-8'))
+
+
+Enclosure = collections.namedtuple("Enclosure", ["href", "length", "type"])
+
+
+def intern_text(text):
+    # for fields with few distinct values across all entries (authors, content types): one shared copy each
+    return sys.intern(text) if isinstance(text, str) else text
 
 
 class FeedEntry(object):
 
+    # entries for every fused feed stay in memory, so no per-entry __dict__
+    __slots__ = ("guid", "title", "author", "summary_type", "summary", "content_type", "content", "link",
+                 "pub_date", "update_date", "enclosures")
+
     def __init__(self, **kwargs):
         self.guid = kwargs.get("guid")
         self.title = kwargs.get("title")
-        self.author = kwargs.get("author")
-        self.summary_type = kwargs.get("summary_type")
+        self.author = intern_text(kwargs.get("author"))
+        self.summary_type = intern_text(kwargs.get("summary_type"))
         self.summary = kwargs.get("summary")
-        self.content_type = kwargs.get("content_type")
+        self.content_type = intern_text(kwargs.get("content_type"))
         self.content = kwargs.get("content")
         self.link = kwargs.get("link")
         self.pub_date = kwargs.get("pub_date")
@@ -181,28 +646,39 @@ class FeedEntry(object):
     def __repr__(self):
         return "<FeedEntry link='%s'>" % (self.link.encode('utf-8'))
 
+    @classmethod
+    def parsed_entry_fingerprint(cls, entry):
+        # covers every field create_from_parsed_entry reads
+        summary_detail = entry.get("summary_detail")
+        return hash((entry.get("id"), entry.get("title"), entry.get("author"), entry.get("link"),
+                     entry.get("published"), entry.get("updated"),
+                     summary_detail.get("type") if summary_detail else None, entry.get("summary"),
+                     tuple((c.get("type"), c.get("value")) for c in entry.get("content", ())),
+                     tuple((e.get("href"), e.get("length"), e.get("type")) for e in entry.get("enclosures", ()))))
+
     @classmethod
     def create_from_parsed_entry(cls, entry):
         item = cls(guid=entry.guid, title=entry.get("title"), author=entry.get("author"), link=entry.get("link"))
         item.pub_date = entry.get("published")
         if item.pub_date:
-            item.pub_date = parser.parse(item.pub_date)
+            item.pub_date = parse_entry_date(item.pub_date, entry.get("published_parsed"))
         item.update_date = entry.get("updated")
         if item.update_date:
-            item.update_date = parser.parse(item.update_date)
+            item.update_date = parse_entry_date(item.update_date, entry.get("updated_parsed"))
         else:
             if item.pub_date:
                 item.update_date = item.pub_date
             else:
                 item.update_date = datetime.datetime.now(datetime.timezone.utc)
         if entry.get("summary_detail"):
-            item.summary_type = entry.summary_detail.type
+            item.summary_type = intern_text(entry.summary_detail.type)
             item.summary = entry.summary
         if entry.get("content"):
-            item.content_type = entry.content[0].type
+            item.content_type = intern_text(entry.content[0].type)
             item.content = entry.content[0].value
         if entry.get("enclosures"):
-            item.enclosures = entry.enclosures
+            item.enclosures = tuple(Enclosure(enclosure.get("href"), enclosure.get("length"), intern_text(enclosure.get("type")))
+                                    for enclosure in entry.enclosures)
         if not item.guid:
             item_stuff = ""
             if item.title:
@@ -218,14 +694,42 @@ class FeedEntry(object):
         return item
 
 
+def never(entry):
+    return False
+
+
+def compile_filters(filters):
+    # one predicate for a list of filters: an entry is kept only if every filter allows it.
+    # The cheapest filters run first, so the expensive ones only see entries the others let through
+    predicates = [fil.predicate for fil in sorted(filters or [], key=lambda fil: fil.cost)]
+    if not predicates:
+        return None
+    if len(predicates) == 1:
+        return predicates[0]
+
+    def allows(entry):
+        for predicate in predicates:
+            if not predicate(entry):
+                return False
+        return True
+    return allows
+
+
 class FeedFilter(object):
 
     name = "default"
+    registry = ClassRegistry("filter type", "feedfuser.filters")
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "name" in cls.__dict__:
+            FeedFilter.registry.register(cls.name, cls)
 
     def __init__(self, mode, filter_type, rules):
         self.mode = mode
         self.filter_type = filter_type
         self.rules = rules
+        self.predicate = self.compile()
 
     def __repr__(self):
         return '%s(mode="%s", filter_type="%s")' % (self.__class__.__name__,
@@ -246,15 +750,57 @@ class FeedFilter(object):
 
     @classmethod
     def make_filter(cls, filter_type, mode, rules):
-        filter_classes = all_subclasses(cls)
-        filter_class = next(x for x in filter_classes if x.name == filter_type)
-        if filter_class:
-            return filter_class(mode=mode, rules=rules)
-        else:
-            return FeedFilter(mode=mode, filter_type=filter_type, rules=rules)
+        filter_class = FeedFilter.registry.lookup(filter_type)
+        return filter_class(mode=mode, rules=rules)
+
+    @property
+    def cost(self):
+        return sum(rule.cost for rule in self.rules)
+
+    @property
+    def fields(self):
+        return frozenset(rule.field for rule in self.rules)
+
+    @property
+    def definition(self):
+        return (self.filter_type, self.mode, tuple((rule.op, rule.field, rule.value) for rule in self.rules))
+
+    def compile_rules(self, combine=False):
+        # the rules' matchers, cheapest first.  With combine (for "any rule matches" modes), the pattern rules
+        # and many contains rules on the same field become one pattern that finds any of them in a single pass
+        rules = self.rules
+        matchers = []
+        if combine:
+            groups = collections.defaultdict(list)
+            for rule in rules:
+                groups[rule.field].append(rule)
+            combined = set()
+            for field, group in groups.items():
+                literals = [rule for rule in group if rule.literal()]
+                if len(literals) < patterns.COMBINE_MIN_RULES:
+                    literals = []
+                regexes = [rule for rule in group if patterns.is_mergeable(rule.pattern())]
+                merged = literals + regexes
+                if len(merged) < 2:
+                    continue
+                regex = re.compile(patterns.alternation([rule.literal() for rule in literals],
+                                                        [rule.pattern() for rule in regexes]))
+                matchers.append((max(rule.cost for rule in merged), patterns.search_matcher(field, regex)))
+                combined.update(id(rule) for rule in merged)
+            rules = [rule for rule in rules if id(rule) not in combined]
+        matchers.extend((rule.cost, rule.matcher) for rule in rules)
+        return [matcher for cost, matcher in sorted(matchers, key=lambda item: item[0])]
+
+    def compile(self):
+        # turns mode and rules into a single function of an entry that says whether to keep it
+        return lambda entry: True
+
+    def allows(self, entry):
+        return self.predicate(entry)
 
     def apply(self, entries):
-        return entries
+        predicate = self.predicate
+        return [entry for entry in entries if predicate(entry)]
 
 
 class FeedFilterBlock(FeedFilter):
@@ -264,23 +810,26 @@ class FeedFilterBlock(FeedFilter):
     def __init__(self, mode, rules):
         super(FeedFilterBlock, self).__init__(filter_type=self.__class__.name, mode=mode, rules=rules)
 
-    def apply(self, entries):
-        results = []
-        for entry in entries:
-            if self.mode.lower() == "or":  # if an entry matches any of the rules, exclude it
-                for rule in self.rules:
-                    if rule.apply(entry):
+    def compile(self):
+        matchers = self.compile_rules(combine=self.mode.lower() == "or")
+        if self.mode.lower() == "or":  # if an entry matches any of the rules, exclude it
+            def allows(entry):
+                for matcher in matchers:
+                    if matcher(entry):
                         # one of the rules matched -- exclude it
-                        break
-                else:
-                    results.append(entry)
-            elif self.mode.lower() == "and":  # entry must match against all rules to be excluded
-                for rule in self.rules:
-                    if not rule.apply(entry):
+                        return False
+                return True
+        elif self.mode.lower() == "and":  # entry must match against all rules to be excluded
+            def allows(entry):
+                for matcher in matchers:
+                    if not matcher(entry):
                         # one of the rules didn't match -- should not be excluded
-                        results.append(entry)
-                        break
-        return results
+                        return True
+                return False
+        else:
+            allows = never
+        return allows
+
 
 class FeedFilterAllow(FeedFilter):
 
@@ -289,33 +838,43 @@ class FeedFilterAllow(FeedFilter):
     def __init__(self, mode, rules):
         super(FeedFilterAllow, self).__init__(filter_type=self.__class__.name, mode=mode, rules=rules)
 
-    def apply(self, entries):
-        results = []
-        for entry in entries:
-            if self.mode.lower() == "or":  # if an entry matches any of the rules, exclude it
-                for rule in self.rules:
-                    if rule.apply(entry):
+    def compile(self):
+        matchers = self.compile_rules(combine=self.mode.lower() == "or")
+        if self.mode.lower() == "or":  # if an entry matches any of the rules, include it
+            def allows(entry):
+                for matcher in matchers:
+                    if matcher(entry):
                         # one of the rules matched -- include it
-                        results.append(entry)
-                        break
-            elif self.mode.lower() == "and":  # entry must match against all rules to be excluded
-                for rule in self.rules:
-                    if not rule.apply(entry):
+                        return True
+                return False
+        elif self.mode.lower() == "and":  # entry must match against all rules to be included
+            def allows(entry):
+                for matcher in matchers:
+                    if not matcher(entry):
                         # one of the rules didn't match -- exclude it
-                        break
-                else:
-                    results.append(entry)
-        return results
+                        return False
+                return True
+        else:
+            allows = never
+        return allows
 
 
 class FeedFilterRule(object):
 
     name = "default"
+    cost = 1  # relative cost of matching one entry, used to order rules
+    registry = ClassRegistry("rule op", "feedfuser.rules")
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "name" in cls.__dict__:
+            FeedFilterRule.registry.register(cls.name, cls)
 
     def __init__(self, op, field, value):
         self.op = op
         self.field = field
         self.value = value
+        self.matcher = self.compile()
 
     def __repr__(self):
         return '%s(op="%s", field="%s", value="%s")' % (self.__class__.__name__,
@@ -337,45 +896,106 @@ class FeedFilterRule(object):
 
     @classmethod
     def make_rule(cls, op, field, value):
-        rule_classes = all_subclasses(cls)
-        rule_class = next(x for x in rule_classes if x.name == op)
-        if rule_class:
-            return rule_class(field=field, value=value)
-        else:
-            return FeedFilterRule(op=op, field=field, value=value)
+        rule_class = FeedFilterRule.registry.lookup(op)
+        return rule_class(field=field, value=value)
+
+    def compile(self):
+        # a function of an entry that says whether the rule matches it, with field and value already bound
+        return never
+
+    def literal(self):
+        # the substring this rule looks for, if matching it is nothing more than a substring test
+        return None
+
+    def pattern(self):
+        # the regular expression this rule searches its field for, if it is nothing more than that
+        return None
 
     def apply(self, entry):
-        return False
+        return self.matcher(entry)
 
 
 class FeedFilterRuleContains(FeedFilterRule):
 
     name = "contains"
+    cost = 1
 
     def __init__(self, field, value):
         super(FeedFilterRuleContains, self).__init__(op=self.__class__.name, field=field, value=value)
 
-    def apply(self, entry):
-        if hasattr(entry, self.field) and self.value:
-            text = getattr(entry, self.field)
-            if text.find(self.value) != -1:
-                return True
-        return False
+    def compile(self):
+        field = self.field
+        value = self.value
+        if not value:
+            return never
+
+        def matches(entry):
+            text = getattr(entry, field, None)
+            return bool(text) and value in text
+        return matches
+
+    def literal(self):
+        return self.value or None
+
+
+class FeedFilterRuleRegex(FeedFilterRule):
+
+    name = "regex"
+    cost = 5
+
+    def __init__(self, field, value):
+        super(FeedFilterRuleRegex, self).__init__(op=self.__class__.name, field=field, value=value)
+
+    def compile(self):
+        if not self.value:
+            return never
+        return patterns.search_matcher(self.field, re.compile(self.pattern()))
+
+    def pattern(self):
+        return self.value or None
+
+
+class FeedFilterRuleIContains(FeedFilterRuleRegex):
+
+    name = "icontains"
+    cost = 2
+
+    def pattern(self):
+        return "(?i:%s)" % re.escape(self.value) if self.value else None
+
+
+class FeedFilterRuleWord(FeedFilterRuleRegex):
+
+    name = "word"
+    cost = 3
+
+    def pattern(self):
+        # \b would only work for values that start and end with a word character
+        return r"(?<!\w)%s(?!\w)" % re.escape(self.value) if self.value else None
 
 
 class FeedFilterRuleXPath(FeedFilterRule):
 
     name = "xpath"
+    cost = 100
 
     def __init__(self, field, value):
         super(FeedFilterRuleXPath, self).__init__(op=self.__class__.name, field=field, value=value)
 
-    def apply(self, entry):
-        if hasattr(entry, self.field) and self.value:
-            text = getattr(entry, self.field)
-            if not text:
+    def compile(self):
+        field = self.field
+        value = self.value
+        if not value:
+            return never
+
+        from lxml import etree
+        xpath = etree.XPath(value, namespaces=XPATH_NAMESPACES, smart_strings=False)
+
+        def matches(entry):
+            root = parsed_field(entry, field)
+            if root is None:
                 return False
-            selector = parsel.Selector(text)
-            if (selector.xpath(self.value)):
-                return True
-        return False
+            result = xpath(root)
+            # as with parsel, a result that isn't a node-set (a boolean, number or string) counts as a match
+            return bool(result) if isinstance(result, list) else True
+        return matches
@@ -528,6 +528,7 @@ class _FeedParserMixin:
                 self._matchnamespaces[k.lower()] = v
         self.feeddata = FeedParserDict() # feed-level data
         self.encoding = encoding # character encoding
+        self.date_hint = None # see _parse_date
         self.entries = [] # list of entry-level data
         self.version = '' # feed type/version, see SUPPORTED_VERSIONS
         self.namespacesInUse = {} # dictionary of namespaces defined by the feed
@@ -1395,10 +1396,13 @@ class _FeedParserMixin:
                 key, value = validity_detail.split('=', 1)
                 if key == 'start':
                     self._save('validity_start', value, overwrite=True)
-                    self._save('validity_start_parsed', _parse_date(value), overwrite=True)
+                    self._save('validity_start_parsed', self._parse_date(value), overwrite=True)
                 elif key == 'end':
                     self._save('validity_end', value, overwrite=True)
-                    self._save('validity_end_parsed', _parse_date(value), overwrite=True)
+                    self._save('validity_end_parsed', self._parse_date(value), overwrite=True)
+
+    def _parse_date(self, dateString):
+        return _parse_date(dateString, self.date_hint)
 
     def _start_published(self, attrsD):
         self.push('published', 1)
@@ -1408,7 +1412,7 @@ class _FeedParserMixin:
 
     def _end_published(self):
         value = self.pop('published')
-        self._save('published_parsed', _parse_date(value), overwrite=True)
+        self._save('published_parsed', self._parse_date(value), overwrite=True)
     _end_dcterms_issued = _end_published
     _end_issued = _end_published
     _end_pubdate = _end_published
@@ -1422,7 +1426,7 @@ class _FeedParserMixin:
 
     def _end_updated(self):
         value = self.pop('updated')
-        parsed_value = _parse_date(value)
+        parsed_value = self._parse_date(value)
         self._save('updated_parsed', parsed_value, overwrite=True)
     _end_modified = _end_updated
     _end_dcterms_modified = _end_updated
@@ -1435,14 +1439,14 @@ class _FeedParserMixin:
 
     def _end_created(self):
         value = self.pop('created')
-        self._save('created_parsed', _parse_date(value), overwrite=True)
+        self._save('created_parsed', self._parse_date(value), overwrite=True)
     _end_dcterms_created = _end_created
 
     def _start_expirationdate(self, attrsD):
         self.push('expired', 1)
 
     def _end_expirationdate(self):
-        self._save('expired_parsed', _parse_date(self.pop('expired')), overwrite=True)
+        self._save('expired_parsed', self._parse_date(self.pop('expired')), overwrite=True)
 
     # geospatial location, or "where", from georss.org
 
@@ -2834,6 +2838,10 @@ def _open_resource(url_file_stream_or_string, etag, modified, agent, referrer, h
     if hasattr(url_file_stream_or_string, 'read'):
         return url_file_stream_or_string
 
+    # a document that is already in memory, e.g. an HTTP response body: don't try it as a url or filename first
+    if isinstance(url_file_stream_or_string, bytes):
+        return _StringIO(url_file_stream_or_string)
+
     if isinstance(url_file_stream_or_string, str) \
        and urllib.parse.urlparse(url_file_stream_or_string)[0] in ('http', 'https', 'ftp', 'file', 'feed'):
         # Deal with the feed URI scheme
@@ -3443,11 +3451,26 @@ def _parse_date_perforce(aDateString):
         return time.gmtime(rfc822.mktime_tz(tm))
 registerDateHandler(_parse_date_perforce)
 
-def _parse_date(dateString):
-    '''Parses a variety of date formats into a 9-tuple in GMT'''
+# recently parsed date strings; feeds repeat dates a lot, e.g. between published and updated
+_date_cache = {}
+_DATE_CACHE_SIZE = 4096
+
+def _parse_date(dateString, hint=None):
+    '''Parses a variety of date formats into a 9-tuple in GMT
+
+    hint, if given, is a dict that remembers which handler parsed the last
+    date; that handler is tried first next time.  Keep one per source to
+    skip the handlers that source's dates never match.'''
     if not dateString:
         return None
-    for handler in _date_handlers:
+    date9tuple = _date_cache.get(dateString)
+    if date9tuple is not None:
+        return date9tuple
+    handlers = _date_handlers
+    preferred = hint.get('handler') if hint is not None else None
+    if preferred is not None:
+        handlers = itertools.chain([preferred], (h for h in _date_handlers if h is not preferred))
+    for handler in handlers:
         try:
             date9tuple = handler(dateString)
         except (KeyError, OverflowError, ValueError):
@@ -3456,6 +3479,11 @@ def _parse_date(dateString):
             continue
         if len(date9tuple) != 9:
             continue
+        if hint is not None:
+            hint['handler'] = handler
+        if len(_date_cache) >= _DATE_CACHE_SIZE:
+            _date_cache.clear()
+        _date_cache[dateString] = date9tuple
         return date9tuple
     return None
 
@@ -3815,12 +3843,15 @@ def _parse_georss_box(value, swap=True, dims=2):
 # end geospatial parsers
 
 
-def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, referrer=None, handlers=None, request_headers=None, response_headers=None):
+def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, referrer=None, handlers=None, request_headers=None, response_headers=None, date_hint=None):
     '''Parse a feed from a URL, file, stream, or string.
 
     request_headers, if given, is a dict from http header name to value to add
     to the request; this overrides internally generated values.
 
+    date_hint, if given, is a dict passed on to _parse_date for every date in
+    the feed; reuse it across parses of the same feed.
+
     :return: A :class:`FeedParserDict`.
     '''
 
@@ -3942,6 +3973,7 @@ def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, refer
     if use_strict_parser:
         # initialize the SAX parser
         feedparser = _StrictFeedParser(baseuri, baselang, 'utf-8')
+        feedparser.date_hint = date_hint
         saxparser = xml.sax.make_parser(PREFERRED_XML_PARSERS)
         saxparser.setFeature(xml.sax.handler.feature_namespaces, 1)
         try:
@@ -3961,6 +3993,7 @@ def parse(url_file_stream_or_string, etag=None, modified=None, agent=None, refer
             use_strict_parser = 0
     if not use_strict_parser and _SGML_AVAILABLE:
         feedparser = _LooseFeedParser(baseuri, baselang, 'utf-8', entities)
+        feedparser.date_hint = date_hint
         feedparser.feed(data.decode('utf-8', 'replace'))
     result['feed'] = feedparser.feeddata
     result['entries'] = feedparser.entries
@@ -0,0 +1,120 @@
+import os, threading
+import concurrent.futures
+
+# fetching feeds is I/O bound, so one long-lived pool of threads per process is shared by every request,
+# every fused feed and the background refresh scheduler
+DEFAULT_MAX_WORKERS = int(os.environ.get("FEEDFUSER_FETCH_WORKERS", 10))
+# fetches a request is waiting for get a few threads of their own, so they never queue behind background refreshes
+DEFAULT_MAX_URGENT_WORKERS = int(os.environ.get("FEEDFUSER_URGENT_FETCH_WORKERS", 4))
+# keep-alive connections are pooled per host, at most this many to any one host at a time
+DEFAULT_MAX_PER_HOST = int(os.environ.get("FEEDFUSER_MAX_PER_HOST", 4))
+DEFAULT_MAX_HOSTS = 50
+
+_pool = None
+_pool_pid = None
+_urgent_pool = None
+_urgent_pool_pid = None
+_max_workers = DEFAULT_MAX_WORKERS
+_lock = threading.Lock()
+_adapter = None
+_adapter_pid = None
+_local = threading.local()
+
+
+def configure(max_workers=DEFAULT_MAX_WORKERS):
+    global _max_workers, _pool
+    with _lock:
+        _max_workers = max_workers
+        old_pool, _pool = _pool, None
+    if old_pool:
+        old_pool.shutdown(wait=False)
+
+
+def get_pool():
+    global _pool, _pool_pid
+    with _lock:
+        # threads don't survive a fork, so a pre-forked worker gets a pool of its own
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = concurrent.futures.ThreadPoolExecutor(max_workers=_max_workers, thread_name_prefix="feedfuser-fetch")
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def get_urgent_pool():
+    global _urgent_pool, _urgent_pool_pid
+    with _lock:
+        if _urgent_pool is None or _urgent_pool_pid != os.getpid():
+            _urgent_pool = concurrent.futures.ThreadPoolExecutor(max_workers=DEFAULT_MAX_URGENT_WORKERS,
+                                                                 thread_name_prefix="feedfuser-urgent")
+            _urgent_pool_pid = os.getpid()
+        return _urgent_pool
+
+
+def submit(fn, *args, **kwargs):
+    return get_pool().submit(fn, *args, **kwargs)
+
+
+def submit_urgent(fn, *args, **kwargs):
+    return get_urgent_pool().submit(fn, *args, **kwargs)
+
+
+def get_adapter():
+    global _adapter, _adapter_pid
+    with _lock:
+        if _adapter is None or _adapter_pid != os.getpid():
+            # requests is imported on the first fetch, not when a worker starts
+            import requests.adapters
+            # pool_block makes a thread wait for one of the host's connections instead of opening another one
+            _adapter = requests.adapters.HTTPAdapter(pool_connections=DEFAULT_MAX_HOSTS, pool_maxsize=DEFAULT_MAX_PER_HOST,
+                                                     pool_block=True)
+            _adapter_pid = os.getpid()
+        return _adapter
+
+
+def get_session():
+    # one Session per thread, all of them sharing the same connection pools
+    adapter = get_adapter()
+    session = getattr(_local, "session", None)
+    if session is None or session.get_adapter("http://") is not adapter:
+        import http.cookiejar
+        import requests
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        # cookies set by one source must not leak into requests for another
+        session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        _local.session = session
+    return session
+
+
+class SingleFlight(object):
+    # runs a call once per key at a time: callers that arrive while a call for their key is in flight
+    # wait for it and get its result (or its exception) instead of making their own
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self.calls[key] = future
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,72 @@
+import re
+
+# below this many values, separate substring tests beat a combined pattern
+COMBINE_MIN_RULES = 8
+
+
+def trie_pattern(words):
+    # a regular expression matching any of words, with shared prefixes merged into nested groups, e.g.
+    # ["Victor Mair", "Victoria", "Mark"] -> (?:Mark|Victor(?:ia| Mair)).  The regex engine then walks
+    # the trie once at each position of the text instead of trying every word in turn, which works like
+    # an Aho-Corasick automaton and keeps the cost nearly flat in the number of words
+    root = {}
+    for word in words:
+        node = root
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = None
+    # built bottom up with a stack of our own: walking the trie recursively takes a call per character,
+    # and a value a few thousand characters long would run out of stack
+    patterns = {}
+    stack = [(root, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if children_done:
+            patterns[id(node)] = _trie_node_pattern(node, patterns)
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for ch, child in node.items() if ch)
+    return patterns[id(root)]
+
+
+def _trie_node_pattern(node, patterns):
+    # patterns holds the pattern of each of node's children already
+    alternatives = [re.escape(ch) + patterns[id(child)] for ch, child in sorted(node.items()) if ch]
+    if not alternatives:
+        return ""
+    is_word_end = "" in node
+    if len(alternatives) == 1 and not is_word_end:
+        return alternatives[0]
+    pattern = "(?:" + "|".join(alternatives) + ")"
+    if is_word_end:
+        pattern += "?"
+    return pattern
+
+
+def is_mergeable(pattern):
+    # whether pattern can be one branch of a larger alternation and still match the same things: it must
+    # not set global flags, and must have no groups that backreferences could count on
+    if not pattern:
+        return False
+    try:
+        return re.compile("(?:%s)" % pattern).groups == 0
+    except re.error:
+        return False
+
+
+def alternation(literals, regexes):
+    # one pattern matching any of the literal strings or any of the regular expressions
+    branches = ["(?:%s)" % pattern for pattern in regexes]
+    if literals:
+        branches.insert(0, trie_pattern(literals))
+    return "|".join(branches)
+
+
+def search_matcher(field, regex):
+    # a rule matcher: does regex occur anywhere in the entry's field
+    search = regex.search
+
+    def matches(entry):
+        text = getattr(entry, field, None)
+        return bool(text) and search(text) is not None
+    return matches
@@ -0,0 +1,236 @@
+import time, random, threading
+import concurrent.futures
+from lib import fetcher
+
+
+class SourceJob(object):
+
+    def __init__(self, feed_id, source, interval):
+        self.feed_id = feed_id
+        self.source = source
+        self.interval = interval
+        self.next_run = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_ok = None  # the last successful fetch; last_run counts failed ones too
+        self.future = None
+        self.started = False
+
+    def __repr__(self):
+        return '%s(feed_id="%s", uri="%s")' % (self.__class__.__name__, self.feed_id, self.source.uri)
+
+
+class RefreshScheduler(object):
+    # keeps one live FusedFeed per spec in the registry (see lib/specs.py) and refreshes each of its sources in the
+    # background, so that requests are served from memory instead of waiting on upstream servers.  The registry
+    # is polled for changed specs, and expired values are swept from the cache backend, from the same thread
+
+    def __init__(self, registry, interval=900, jitter=0.1, max_backoff=4*3600, timeout=10, max_stale=3600,
+                 backend=None, purge_interval=3600):
+        self.registry = registry
+        self.backend = backend
+        self.purge_interval = purge_interval
+        self.next_purge = time.time() + purge_interval
+        self.interval = interval
+        self.max_stale = max_stale
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.feeds = {}
+        self.jobs = {}
+        self.refreshed = {}
+        self.lock = threading.RLock()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __repr__(self):
+        return '%s(spec_dir="%s")' % (self.__class__.__name__, self.registry.spec_dir)
+
+    def sync(self, feed_ids):
+        # pick up the registry's current feeds for feed_ids.  A changed spec gets a new FusedFeed, which is
+        # refreshed as soon as possible; jobs of the old one that are still running are simply forgotten
+        with self.lock:
+            for feed_id in feed_ids:
+                feed = self.registry.get(feed_id)
+                self.refreshed.pop(feed_id, None)
+                if feed is None:
+                    self.feeds.pop(feed_id, None)
+                    self.jobs.pop(feed_id, None)
+                    continue
+                self.feeds[feed_id] = feed
+                self.jobs[feed_id] = [SourceJob(feed_id, source, self.interval_for(feed, source))
+                                      for source in (feed.sources or [])]
+        self.wakeup.set()
+
+    def interval_for(self, feed, source):
+        return source.refresh_interval or feed.refresh_interval or self.interval
+
+    def jittered(self, delay):
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def start(self):
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return
+            # started here rather than in __init__ so that pre-forking servers get their threads in the worker
+            self.stopped.clear()
+            self.sync(self.registry.reload())
+            self.thread = threading.Thread(target=self.run, name="feedfuser-refresh", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        while not self.stopped.is_set():
+            delay = self.run_pending()
+            self.wakeup.wait(delay)
+            self.wakeup.clear()
+
+    def run_pending(self):
+        changed = self.registry.poll()
+        if changed:
+            self.sync(changed)
+        now = time.time()
+        next_wakeup = min(now + self.interval, self.registry.next_poll)
+        with self.lock:
+            for jobs in self.jobs.values():
+                for job in jobs:
+                    if job.future:
+                        continue
+                    if job.next_run <= now:
+                        self.submit(job)
+                    else:
+                        next_wakeup = min(next_wakeup, job.next_run)
+        if self.backend:
+            if self.next_purge <= now:
+                self.purge()
+            next_wakeup = min(next_wakeup, self.next_purge)
+        return max(next_wakeup - now, 0)
+
+    def purge(self):
+        self.next_purge = time.time() + self.purge_interval
+        try:
+            self.backend.purge()
+        except (IOError, OSError) as exc:
+            print(('%r could not be purged: %s' % (self.backend, exc)))
+
+    def submit(self, job, urgent=False):
+        # queues job on the shared fetch pool.  A request waiting for it (urgent) also queues it on the urgent pool,
+        # so it doesn't wait behind the refreshes of every other feed, as in a new worker; whichever pool gets to
+        # it first runs it, and job.future gets its result either way
+        with self.lock:
+            if not job.future:
+                job.future = concurrent.futures.Future()
+                job.started = False
+                fetcher.submit(self.start_job, job, job.future)
+            future = job.future
+            if urgent and not job.started:
+                fetcher.submit_urgent(self.start_job, job, future)
+            return future
+
+    def start_job(self, job, future):
+        with self.lock:
+            if job.future is not future or job.started:
+                return
+            job.started = True
+        try:
+            ok = self.run_job(job)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        future.set_result(ok)
+
+    def run_job(self, job):
+        try:
+            # what another worker fetched less than half an interval ago is as good as fetching it ourselves
+            ok = job.source.fetch(timeout=self.timeout, fresh_for=job.interval / 2) is not None
+        except Exception as exc:
+            print(('%r generated an exception: %s' % (job.source.uri, exc)))
+            ok = False
+        now = time.time()
+        with self.lock:
+            if ok:
+                job.failures = 0
+                # as old as what the source got, which may be a copy another worker fetched a little earlier
+                job.last_ok = max(job.last_ok or 0, job.source.checked or now)
+                job.next_run = now + self.jittered(job.interval)
+            else:
+                # exponential backoff; the source keeps serving its last good entries meanwhile
+                job.failures += 1
+                job.next_run = now + self.jittered(min(job.interval * 2 ** job.failures, self.max_backoff))
+            job.last_run = now
+            job.future = None
+            jobs = self.jobs.get(job.feed_id, [])
+            if job in jobs and all(j.last_run for j in jobs):
+                self.refreshed[job.feed_id] = now
+        self.wakeup.set()
+        return ok
+
+    def refresh_feed(self, feed_id, wait=True):
+        with self.lock:
+            futures = [self.submit(job, urgent=wait) for job in self.jobs.get(feed_id, [])]
+        if wait:
+            concurrent.futures.wait(futures)
+        return self.feeds.get(feed_id)
+
+    def load_stored(self, feed_id):
+        # gives the sources of feed_id that have nothing to serve yet the copy in the store, if upstream sent or
+        # confirmed it at most max_stale seconds ago.  Returns the jobs of the sources left without one
+        with self.lock:
+            jobs = [job for job in self.jobs.get(feed_id, []) if not job.last_run and not job.last_ok]
+        missing = []
+        for job in jobs:
+            if job.source.load_stored(self.max_stale):
+                with self.lock:
+                    job.last_ok = max(job.last_ok or 0, job.source.checked)
+            else:
+                missing.append(job)
+        return missing
+
+    def revalidate(self, feed_id, wait=False):
+        # refresh the sources of feed_id that are past their interval, except those backing off after a failure:
+        # they keep serving their last good entries rather than have every request hit a failing server
+        now = time.time()
+        with self.lock:
+            futures = [self.submit(job, urgent=wait) for job in self.jobs.get(feed_id, [])
+                       if job.future or (now - (job.last_ok or 0) >= job.interval
+                                         and not (job.failures and job.next_run > now))]
+        if wait:
+            concurrent.futures.wait(futures)
+
+    def freshness(self, feed_id):
+        # (age, lifetime) of feed_id: seconds since the least recently refreshed of its sources was last fetched
+        # successfully, so the age of a source that keeps failing keeps growing, and the shortest refresh interval
+        # of its sources.  Sources that never were fetched have no entries to age.  None until one of them was
+        with self.lock:
+            jobs = self.jobs.get(feed_id)
+            fetched = [job.last_ok for job in jobs or [] if job.last_ok]
+            if not fetched:
+                return None
+            return time.time() - min(fetched), min(job.interval for job in jobs)
+
+    def get(self, feed_id):
+        # the live FusedFeed for feed_id.  Stale sources are refreshed in the background while the feed is served as
+        # it is (stale-while-revalidate).  The first time a worker serves a feed (or first since its spec changed),
+        # sources start out from the copy in the store; requests only wait for upstream servers for sources without
+        # one, or once the feed is more than max_stale seconds old
+        self.start()
+        with self.lock:
+            feed = self.feeds.get(feed_id)
+        if feed is None:
+            return None
+        if feed_id not in self.refreshed:
+            missing = self.load_stored(feed_id)
+            if missing:
+                with self.lock:
+                    futures = [self.submit(job, urgent=True) for job in missing]
+                concurrent.futures.wait(futures)
+        freshness = self.freshness(feed_id)
+        if freshness and freshness[0] >= freshness[1]:
+            self.revalidate(feed_id, wait=freshness[0] > self.max_stale)
+        return feed
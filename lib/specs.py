@@ -0,0 +1,86 @@
+import os, os.path, glob
+import time, threading
+from lib import feedops
+
+
+class FeedSpec(object):
+    # one feed definition as compiled from its spec file, and the state of that file when it was read
+
+    def __init__(self, feed_id, path, stamp, feed=None):
+        self.feed_id = feed_id
+        self.path = path
+        self.stamp = stamp
+        self.feed = feed
+
+    def __repr__(self):
+        return '%s(feed_id="%s")' % (self.__class__.__name__, self.feed_id)
+
+
+class SpecRegistry(object):
+    # every feed definition in spec_dir, parsed and compiled into a FusedFeed once.  reload() reads again only the
+    # files whose modification time or size changed and then swaps in the whole new set at once, so looking up
+    # a feed never touches the filesystem and never sees a half-reloaded registry
+
+    def __init__(self, spec_dir, store=None, poll_interval=5):
+        self.spec_dir = spec_dir
+        self.store = store
+        self.poll_interval = poll_interval
+        self.specs = {}
+        self.last_poll = None
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(spec_dir="%s")' % (self.__class__.__name__, self.spec_dir)
+
+    def __contains__(self, feed_id):
+        return feed_id in self.specs
+
+    def get(self, feed_id):
+        # the FusedFeed for feed_id; None if there is no such spec or it could not be loaded
+        spec = self.specs.get(feed_id)
+        return spec.feed if spec else None
+
+    def reload(self):
+        # returns the ids of the feeds that were added, changed or removed
+        with self.lock:
+            old_specs = self.specs
+            specs = {}
+            changed = set()
+            for spec_path in sorted(glob.glob(os.path.join(self.spec_dir, "*.json"))):
+                feed_id = os.path.splitext(os.path.basename(spec_path))[0]
+                try:
+                    stat = os.stat(spec_path)
+                except OSError:
+                    continue
+                stamp = (stat.st_mtime_ns, stat.st_size)
+                spec = old_specs.get(feed_id)
+                if spec is None or spec.stamp != stamp:
+                    spec = FeedSpec(feed_id, spec_path, stamp, feed=self.load_feed(spec_path))
+                    changed.add(feed_id)
+                specs[feed_id] = spec
+            changed.update(set(old_specs) - set(specs))
+            self.specs = specs
+            self.last_poll = time.time()
+        return changed
+
+    def load_feed(self, spec_path):
+        try:
+            feed = feedops.FusedFeed.load_from_spec_file(spec_path, store=self.store)
+        except Exception as exc:
+            print(('%s could not be loaded: %s' % (spec_path, exc)))
+            return None
+        if not feed:
+            print(('%s could not be loaded: %s' % (spec_path, "empty feed definition")))
+        return feed
+
+    @property
+    def next_poll(self):
+        if self.last_poll is None:
+            return time.time()
+        return self.last_poll + self.poll_interval
+
+    def poll(self):
+        # reload once poll_interval has passed since spec_dir was last looked at
+        if time.time() < self.next_poll:
+            return set()
+        return self.reload()